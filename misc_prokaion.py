@@ -5,6 +5,8 @@ import os
 import sys
 import re
 import subprocess
+import threading
+import collections
 import shutil
 import logging
 import datetime
@@ -59,6 +61,9 @@ CYAN = "\033[36m"
 YELLOW = "\033[93m"
 DIM = "\033[2m"
 
+# Read files accepted as pipeline input (fastq, fast5, pod5), optionally gzipped
+READ_FILE_RE = re.compile(r".*\.(f(ast)*[q5]|pod5)(\.gz)*")
+
 
 ### Executing functions ###
 
@@ -102,6 +107,54 @@ def execute_subprocess(cmd, isShell=False, isInfo=False):
                                                                       str(e)) + END_FORMATTING)
 
 
+def execute_piped_subprocess(cmd, tag="", output_files=[], max_error_lines=50):
+    """
+    https://docs.python.org/3/library/subprocess.html#subprocess.Popen
+    Execute a shell pipeline, draining its stderr into the log while it runs so a full pipe buffer can not stall it
+    The pipeline runs in bash with pipefail, so a failure in any stage (not only the last one) is reported
+    tag: prefix for the logged stderr lines (output file or sample), to tell apart pipelines running in parallel
+    output_files: removed if the pipeline fails, so a partial output is not taken as done in a re-run
+    Only the last max_error_lines stderr lines are kept to report a failure
+    """
+
+    logger.debug("")
+    logger.debug(cmd)
+
+    prog = tag if tag else cmd
+    stderr_lines = collections.deque(maxlen=max_error_lines)
+    prefix = "[%s] " % tag if tag else ""
+
+    def drain_stderr(stream):
+        # errors="replace": a non UTF-8 byte must not kill the reader and stall the pipeline
+        for line in iter(stream.readline, b""):
+            line = line.decode(errors="replace").rstrip()
+            stderr_lines.append(line)
+            logger.debug(prefix + line)
+        stream.close()
+
+    try:
+        command = subprocess.Popen(
+            "set -o pipefail; " + cmd, shell=True, executable="/bin/bash", stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr_reader = threading.Thread(
+            target=drain_stderr, args=(command.stderr,), daemon=True)
+        stderr_reader.start()
+        command.wait()
+        stderr_reader.join()
+
+        if command.returncode == 0:
+            logger.debug(
+                GREEN + DIM + "Pipeline %s successfully executed" % prog + END_FORMATTING)
+        else:
+            logger.info(RED + BOLD + "Pipeline %s FAILED\n" % prog + END_FORMATTING + BOLD + "with command: " + END_FORMATTING + cmd +
+                        "\n" + BOLD + "EXIT-CODE: %d\n" % command.returncode + "ERROR:\n" + END_FORMATTING + "\n".join(stderr_lines).strip())
+            for output_file in output_files:
+                check_remove_file(output_file)
+
+    except OSError as e:
+        sys.exit(RED + BOLD + "Failed to execute program '%s': %s" % (prog,
+                                                                      str(e)) + END_FORMATTING)
+
+
 ### Manipulation of files and paths ###
 
 
@@ -130,6 +183,14 @@ def check_file_exists(file_name):
     return os.path.isfile(file_name)
 
 
+def check_file_updated(file_name, source_file):
+    """
+    Check file exist and is not older than the file it was generated from (make-style freshness).
+    """
+
+    return os.path.isfile(file_name) and os.path.getmtime(file_name) >= os.path.getmtime(source_file)
+
+
 def check_remove_file(file_name):
     """
     Check file exist and remove it.
@@ -142,16 +203,11 @@ def check_remove_file(file_name):
 def extract_read_list(input_dir):
 
     input_dir = os.path.abspath(input_dir)
-    all_files = []
 
-    for root, _, files in os.walk(input_dir):
-        if root == input_dir:  # This only apply to parent folder, not subdirectories
-            for name in files:
-                filename = os.path.join(root, name)
-                # is_files = re.match(r".*\.f(ast)*[q5](\.gz)*", name)
-                is_files = re.match(r".*\.(f(ast)*[q5]|pod5)(\.gz)*", name)
-                if is_files:
-                    all_files.append(filename)
+    # Only the parent folder is listed, subdirectories are not scanned
+    with os.scandir(input_dir) as entries:
+        all_files = [entry.path for entry in entries
+                     if entry.is_file() and READ_FILE_RE.match(entry.name)]
 
     all_files = sorted(all_files)
 
@@ -161,7 +217,7 @@ def extract_read_list(input_dir):
 def extract_sample_list(file):
 
     basename_file = os.path.basename(file)
-    basename_file = basename_file.split(".")[0]
+    basename_file = basename_file.partition(".")[0]
 
     return basename_file
 
@@ -375,13 +431,18 @@ def optimal_chunk_size(reference):
 
     input_reference = os.path.abspath(reference)
     input_folder = os.path.dirname(reference)
-    chunks_size = "chunks_size"
-    chunks_size_path = os.path.join(input_folder, "chunks_size")
+    # Named after the reference so several fasta files in the same folder do not share the cached size
+    chunks_size = os.path.basename(input_reference) + ".chunks_size"
+    chunks_size_path = os.path.join(input_folder, chunks_size)
 
-    cmd_infoseq = ["infoseq", "-auto", "-only", "-length", "-noheading",
-                   "-odirectory", input_folder, "-outfile", chunks_size, input_reference]
-    # print(cmd_infoseq)
-    execute_subprocess(cmd_infoseq, isShell=False)
+    # Reuse the size computed in a previous run unless the reference changed
+    if check_file_updated(chunks_size_path, input_reference):
+        logger.debug(chunks_size_path + " already EXISTS")
+    else:
+        cmd_infoseq = ["infoseq", "-auto", "-only", "-length", "-noheading",
+                       "-odirectory", input_folder, "-outfile", chunks_size, input_reference]
+        # print(cmd_infoseq)
+        execute_subprocess(cmd_infoseq, isShell=False)
 
     df = pd.read_csv(chunks_size_path, header=None)
     size = df.loc[df.index[0]]
@@ -394,7 +455,7 @@ def samtools_faidx(reference):
     input_reference = os.path.abspath(reference)
     fai_reference = input_reference + ".fai"
 
-    if os.path.isfile(fai_reference):
+    if check_file_updated(fai_reference, input_reference):
         logger.info(fai_reference + " already EXISTS")
     else:
         logger.info(GREEN + "Indexing " + fai_reference + END_FORMATTING)
@@ -413,10 +474,10 @@ def create_reference_chunks(reference):
     input_reference = os.path.abspath(reference)
     input_folder = os.path.dirname(reference)
     out_reference_file = os.path.join(
-        input_folder, "reference." + str(num_chunks) + ".regions")
+        input_folder, os.path.basename(input_reference) + "." + str(num_chunks) + ".regions")
     fai_reference = input_reference + ".fai"
 
-    if os.path.isfile(out_reference_file):
+    if check_file_updated(out_reference_file, input_reference):
         logger.info(out_reference_file + " already EXISTS")
     else:
         logger.info(GREEN + "Creating " + out_reference_file + END_FORMATTING)
@@ -427,6 +488,34 @@ def create_reference_chunks(reference):
     return out_reference_file
 
 
+def create_coverage_regions(input_bam, reference, out_regions_file, num_regions=500):
+    """
+    https://github.com/freebayes/freebayes/blob/master/scripts/coverage_to_regions.py
+        # samtools depth -aa aln.bam | coverage_to_regions.py ref.fa.fai 500 > ref.regions
+    Split the reference in regions holding a similar amount of aligned bases instead of a similar length,
+    so a high coverage region does not keep a single freebayes-parallel job running while the rest are done
+    """
+
+    input_reference = os.path.abspath(reference)
+    fai_reference = input_reference + ".fai"
+
+    if check_file_updated(out_regions_file, input_bam):
+        logger.info(out_regions_file + " already EXISTS")
+    else:
+        logger.info(GREEN + "Creating " + out_regions_file + END_FORMATTING)
+        cmd_regions = "samtools depth -aa {} | coverage_to_regions.py {} {} > {}".format(
+            input_bam, fai_reference, str(num_regions), out_regions_file)
+        execute_subprocess(cmd_regions, isShell=True)
+
+    # Fall back to fixed length regions if there is no coverage to balance
+    if os.path.isfile(out_regions_file) and os.path.getsize(out_regions_file) > 0:
+        return out_regions_file
+    else:
+        logger.info(YELLOW + "No coverage regions for " + input_bam +
+                    ", using fixed length regions" + END_FORMATTING)
+        return create_reference_chunks(reference)
+
+
 ### BAM Variant ###
 
 
@@ -19,7 +19,7 @@ import pandas as pd
 
 # Local application imports
 
-from misc_prokaion import (check_create_dir, check_file_exists, extract_read_list, extract_sample_list, execute_subprocess, check_reanalysis, file_to_list, samtools_faidx, create_reference_chunks, extract_indels, merge_vcf, vcf_to_ivar_tsv, create_bamstat,
+from misc_prokaion import (check_create_dir, check_file_exists, extract_read_list, extract_sample_list, execute_subprocess, execute_piped_subprocess, check_reanalysis, file_to_list, samtools_faidx, create_reference_chunks, create_coverage_regions, extract_indels, merge_vcf, vcf_to_ivar_tsv, create_bamstat,
                            create_coverage, obtain_group_cov_stats, obtain_overal_stats, ivar_consensus, replace_consensus_header, remove_low_quality, rename_reference_snpeff, annotate_snpeff, user_annotation, user_annotation_aa, make_blast, kraken, mash_screen)
 
 from compare_snp_prokaion import (ddbb_create_intermediate, recalibrate_ddbb_vcf_intermediate,
@@ -161,7 +161,7 @@ def get_arguments():
     variant_group = parser.add_argument_group(
         "Variant Calling", "Variant Calling parameters")
 
-    variant_group.add_argument("-f", "--min_allele_frequency", type=int, dest="min_allele_frequency", required=False,
+    variant_group.add_argument("-f", "--min_allele_frequency", type=float, dest="min_allele_frequency", required=False,
                                default=0.2, help="Minimum fraction of observations supporting an alternate allele. Default: 0.2")
 
     variant_group.add_argument("-q", "--min_base_quality", type=int, dest="min_quality", required=False,
@@ -170,7 +170,7 @@ def get_arguments():
     variant_group.add_argument("-m", "--min_mapping_quality", type=int, dest="min_mapping", required=False,
                                default=60, help="Exclude alignments from analysis below threshold. Default: 60")
 
-    variant_group.add_argument("-freq", "--min_frequency", type=int, dest="min_frequency", required=False,
+    variant_group.add_argument("-freq", "--min_frequency", type=float, dest="min_frequency", required=False,
                                default=0.7, help="Minimum fraction of observations to call a base. Default: 0.7")
 
     variant_group.add_argument("-d", "--min_depth", type=int, dest="min_depth",
@@ -428,14 +428,18 @@ def ONT_quality(output_samples, out_qc, threads=30):
 
 ### Functions from Varcal_prokaion.py ###
 
-def minimap2_mapping(HQ_filename, filename_bam_out, reference):
+def minimap2_mapping(HQ_filename, filename_bam_out, reference, threads=30):
     """
     https://github.com/lh3/minimap2
         # Oxford Nanopore genomic reads
         minimap2 -ax map-ont ref.fa ont.fq.gz > aln.sam
     http://www.htslib.org/doc/samtools.html
+    https://zlib.net/pigz/
     """
 
+    # pigz -p: Number of threads, -dc: Decompress to stdout
+    # minimap2 inflates gzip in its own reader thread, pigz decompresses the fastq.gz outside it and minimap2 reads from stdin (-)
+
     # -a: Output in the SAM format
     # -x: Preset (always applied before other options; see minimap2.1 for details) []
     #    - map-pb/map-ont - PacBio CLR/Nanopore vs reference mapping
@@ -445,20 +449,32 @@ def minimap2_mapping(HQ_filename, filename_bam_out, reference):
     #    - splice/splice:hq - long-read/Pacbio-CCS spliced alignment
     #    - sr - genomic short-read mapping
     # -t: Number of threads
+    # --sam-hit-only: In SAM output mode, don't output unmapped reads (replaces samtools view -F 4)
 
-    # -b: Output BAM
-    # -S: Ignored (input format is auto-detected)
-    # -F: Only include reads with none of the FLAGS in INT present
-    # --threads: Number of additional threads to use
+    # -@: Number of additional threads to use
+    # -O: Output format, SAM from minimap2 is read by sort directly and written as BAM
+    # --write-index: Automatically index the output files (##idx## sets the .bai name)
+    # -m is left at samtools default (768M per thread), several of these pipelines can run at the same time
 
-    cmd_minimap2 = "minimap2 -ax map-ont {} {} | samtools view -bS -F 4 - | samtools sort -o {}".format(
-        reference, HQ_filename, filename_bam_out)
-    # print(cmd_minimap2)
-    execute_subprocess(cmd_minimap2, isShell=True)
+    filename_bai_out = filename_bam_out + ".bai"
+
+    # threads is the budget of the whole pipeline: a quarter goes to sort, 1-2 to pigz and the rest to minimap2
+    sort_threads = threads // 4
+    if HQ_filename.endswith(".gz") and threads >= 4 and shutil.which("pigz"):
+        decomp_threads = min(2, max(1, threads // 8))
+        cmd_reads = "pigz -p {} -dc {} | ".format(str(decomp_threads), HQ_filename)
+        reads_input = "-"
+    else:
+        decomp_threads = 0
+        cmd_reads = ""
+        reads_input = HQ_filename
+    map_threads = max(1, threads - sort_threads - decomp_threads)
 
-    cmd_indexing = "samtools", "index", filename_bam_out
-    # print(cmd_indexing)
-    execute_subprocess(cmd_indexing, isShell=False)
+    cmd_minimap2 = "{}minimap2 -ax map-ont --sam-hit-only -t {} {} {} | samtools sort -@ {} -O bam --write-index -o {}##idx##{} -".format(
+        cmd_reads, str(map_threads), reference, reads_input, str(sort_threads), filename_bam_out, filename_bai_out)
+    # print(cmd_minimap2)
+    execute_piped_subprocess(
+        cmd_minimap2, tag=os.path.basename(filename_bam_out), output_files=[filename_bam_out, filename_bai_out])
 
 
 def ngmlr_mapping(HQ_filename, filename_bam_out, reference, threads=30):
@@ -473,24 +489,31 @@ def ngmlr_mapping(HQ_filename, filename_bam_out, reference, threads=30):
     # -x <pacbio, ont>, --presets <pacbio, ont>
     # -i <0-1>, --min-identity <0-1> - Alignments with an identity lower than this threshold will be discarded [0.65]
 
-    cmd_ngmlr = "ngmlr -t {} -r {} -q {} -x ont | samtools view -bS -F 4 - | samtools sort -o {}".format(
-        threads, reference, HQ_filename, filename_bam_out)
-    # print(cmd_ngmlr)
-    execute_subprocess(cmd_ngmlr, isShell=True)
+    # -u: Uncompressed BAM output, avoids a compress/decompress round-trip before sort
+    # -F: Only include reads with none of the FLAGS in INT present
 
-    cmd_indexing = "samtools", "index", filename_bam_out
-    # print(cmd_indexing)
-    execute_subprocess(cmd_indexing, isShell=False)
+    filename_bai_out = filename_bam_out + ".bai"
 
+    # threads is the budget of the whole pipeline, a quarter goes to sort and the rest to ngmlr
+    sort_threads = threads // 4
+    map_threads = max(1, threads - sort_threads)
 
-def freebayes_variant(reference, filename_bam_out, output_vcf, threads=36, frequency=0.1, ploidy=1, base_qual=7, map_qual=60):
+    cmd_ngmlr = "ngmlr -t {} -r {} -q {} -x ont | samtools view -u -F 4 - | samtools sort -@ {} -O bam --write-index -o {}##idx##{} -".format(
+        str(map_threads), reference, HQ_filename, str(sort_threads), filename_bam_out, filename_bai_out)
+    # print(cmd_ngmlr)
+    execute_piped_subprocess(
+        cmd_ngmlr, tag=os.path.basename(filename_bam_out), output_files=[filename_bam_out, filename_bai_out])
+
+
+def freebayes_variant(reference, filename_bam_out, output_vcf, threads=36, frequency=0.1, ploidy=1, base_qual=7, map_qual=60, max_coverage=600):
     """
     https://github.com/freebayes/freebayes
         # Freebayes-parallel
         freebayes-parallel <(fasta_generate_regions.py {fai_reference} {chunks}) {threads} {args} > {output}
+        freebayes-parallel <(samtools depth -aa {bam} | coverage_to_regions.py {fai_reference} {regions}) {threads} {args} > {output}
     """
 
-    # --region_file: Genome partitioning according to computational threads.
+    # --region_file: Genome partitioning with a similar number of aligned bases per region.
     # --haplotype_length: Allow haplotype calls with contiguous embedded matches of up to this length
     # --use-best-n-alleles: Evaluate only the best N SNP alleles, ranked by sum of supporting quality scores
     # --min-alternate-count: Require at least this count of observations supporting an alternate allele within a single individual in order to evaluate the position
@@ -499,12 +522,14 @@ def freebayes_variant(reference, filename_bam_out, output_vcf, threads=36, frequ
     # --min-coverage:
     # -q: Exclude alleles from analysis if their supporting base quality is less than Q
     # -m: Exclude alignments from analysis if they have a mapping quality less than Q
+    # --limit-coverage: Downsample per-sample coverage to this level if greater than this coverage, bounds the cost of deep pileups
     # --strict-vcf: Generate strict VCF format (FORMAT/GQ will be an int)
 
-    region_file = create_reference_chunks(reference)
+    region_file = create_coverage_regions(filename_bam_out, reference, os.path.join(
+        os.path.dirname(output_vcf), "coverage.regions"))
 
-    cmd_bayes = "freebayes-parallel {} {} -f {} --haplotype-length 0 --use-best-n-alleles 1 --min-alternate-count 0 --min-alternate-fraction {} -p {} --min-coverage 1 -q {} -m {} --strict-vcf {} > {}".format(
-        region_file, str(threads), reference, str(frequency), str(ploidy), str(base_qual), str(map_qual), filename_bam_out, output_vcf)
+    cmd_bayes = "freebayes-parallel {} {} -f {} --haplotype-length 0 --use-best-n-alleles 1 --min-alternate-count 0 --min-alternate-fraction {} -p {} --min-coverage 1 -q {} -m {} --limit-coverage {} --strict-vcf {} > {}".format(
+        region_file, str(threads), reference, str(frequency), str(ploidy), str(base_qual), str(map_qual), str(max_coverage), filename_bam_out, output_vcf)
     print(cmd_bayes)
     execute_subprocess(cmd_bayes, isShell=True)
 
@@ -667,14 +692,10 @@ if __name__ == "__main__":
 
     # Check how many files will be analysed
 
-    sample_list = []
-
-    for sample in fast5:
-        sample = extract_sample_list(sample)
-        sample_list.append(sample)
+    sample_list = [extract_sample_list(sample) for sample in fast5]
 
-    logger.info("\n" + CYAN + "{} Samples will be analysed: {}".format(
-        len(sample_list), ",".join(sample_list)) + END_FORMATTING)
+    logger.info("\n%s%d Samples will be analysed: %s%s",
+                CYAN, len(sample_list), ",".join(sample_list), END_FORMATTING)
 
 
     ############### START PIPELINE ###############
@@ -1056,7 +1077,7 @@ if __name__ == "__main__":
                                   reference, threads=args.threads)
                 else:
                     minimap2_mapping(HQ_filename, filename_bam_out,
-                                     reference=args.reference)
+                                     reference=args.reference, threads=args.threads)
 
             after = datetime.datetime.now()
             print(f"Done with function {'ngmlr_mapping' if args.amplicon else 'minimap2_mapping'} in: %s" % (
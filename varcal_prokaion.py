@@ -1,19 +1,17 @@
 #!/usr/bin/env python
 
 import os
-import re
 import logging
+import logging.handlers
 import argparse
-import sys
-import subprocess
+import shutil
 import datetime
-import gzip
-import multiprocessing
+import concurrent.futures
 import pandas as pd
 
 # Local application imports
 
-from misc_prokaion import (check_create_dir, check_file_exists, extract_read_list, extract_sample_list, execute_subprocess, check_reanalysis, file_to_list, samtools_faidx, create_reference_chunks, extract_indels, merge_vcf, vcf_to_ivar_tsv, create_bamstat,
+from misc_prokaion import (check_create_dir, check_file_exists, extract_read_list, extract_sample_list, execute_subprocess, execute_piped_subprocess, check_reanalysis, file_to_list, samtools_faidx, create_reference_chunks, create_coverage_regions, extract_indels, merge_vcf, vcf_to_ivar_tsv, create_bamstat,
                            create_coverage, obtain_group_cov_stats, obtain_overal_stats, ivar_consensus, replace_consensus_header, remove_low_quality, rename_reference_snpeff, annotate_snpeff, user_annotation, user_annotation_aa, make_blast, kraken, mash_screen)
 
 from compare_snp_prokaion import (ddbb_create_intermediate, recalibrate_ddbb_vcf_intermediate,
@@ -79,7 +77,7 @@ def get_arguments():
     variant_group.add_argument("-bayes", "--bayes", required=False, action="store_true",
                                help="Variant Calling is done with freebayes-parallel")
 
-    variant_group.add_argument("-f", "--min_allele_frequency", type=int, dest="min_allele_frequency", required=False,
+    variant_group.add_argument("-f", "--min_allele_frequency", type=float, dest="min_allele_frequency", required=False,
                                default=0.2, help="Minimum fraction of observations supporting an alternate allele. Default: 0.2")
 
     variant_group.add_argument("-q", "--min_base_quality", type=int, dest="min_quality", required=False,
@@ -88,7 +86,7 @@ def get_arguments():
     variant_group.add_argument("-m", "--min_mapping_quality", type=int, dest="min_mapping", required=False,
                                default=60, help="Exclude alignments from analysis below threshold. Default: 60")
 
-    variant_group.add_argument("-freq", "--min_frequency", type=int, dest="min_frequency", required=False,
+    variant_group.add_argument("-freq", "--min_frequency", type=float, dest="min_frequency", required=False,
                                default=0.7, help="Minimum fraction of observations to call a base. Default: 0.7")
 
     variant_group.add_argument("-d", "--min_depth", type=int, dest="min_depth",
@@ -188,14 +186,18 @@ def get_arguments():
     return arguments
 
 
-def minimap2_mapping(HQ_filename, filename_bam_out, reference):
+def minimap2_mapping(HQ_filename, filename_bam_out, reference, threads=30):
     """
     https://github.com/lh3/minimap2
         # Oxford Nanopore genomic reads
         minimap2 -ax map-ont ref.fa ont.fq.gz > aln.sam
     http://www.htslib.org/doc/samtools.html
+    https://zlib.net/pigz/
     """
 
+    # pigz -p: Number of threads, -dc: Decompress to stdout
+    # minimap2 inflates gzip in its own reader thread, pigz decompresses the fastq.gz outside it and minimap2 reads from stdin (-)
+
     # -a: Output in the SAM format
     # -x: Preset (always applied before other options; see minimap2.1 for details) []
     #    - map-pb/map-ont - PacBio CLR/Nanopore vs reference mapping
@@ -205,20 +207,51 @@ def minimap2_mapping(HQ_filename, filename_bam_out, reference):
     #    - splice/splice:hq - long-read/Pacbio-CCS spliced alignment
     #    - sr - genomic short-read mapping
     # -t: Number of threads
+    # --sam-hit-only: In SAM output mode, don't output unmapped reads (replaces samtools view -F 4)
 
-    # -b: Output BAM
-    # -S: Ignored (input format is auto-detected)
-    # -F: Only include reads with none of the FLAGS in INT present
-    # --threads: Number of additional threads to use
+    # -@: Number of additional threads to use
+    # -O: Output format, SAM from minimap2 is read by sort directly and written as BAM
+    # --write-index: Automatically index the output files (##idx## sets the .bai name)
+    # -m is left at samtools default (768M per thread), several of these pipelines can run at the same time
+
+    filename_bai_out = filename_bam_out + ".bai"
+
+    # threads is the budget of the whole pipeline: a quarter goes to sort, 1-2 to pigz and the rest to minimap2
+    sort_threads = threads // 4
+    if HQ_filename.endswith(".gz") and threads >= 4 and shutil.which("pigz"):
+        decomp_threads = min(2, max(1, threads // 8))
+        cmd_reads = "pigz -p {} -dc {} | ".format(str(decomp_threads), HQ_filename)
+        reads_input = "-"
+    else:
+        decomp_threads = 0
+        cmd_reads = ""
+        reads_input = HQ_filename
+    map_threads = max(1, threads - sort_threads - decomp_threads)
 
-    cmd_minimap2 = "minimap2 -ax map-ont {} {} | samtools view -bS -F 4 - | samtools sort -o {}".format(
-        reference, HQ_filename, filename_bam_out)
+    cmd_minimap2 = "{}minimap2 -ax map-ont --sam-hit-only -t {} {} {} | samtools sort -@ {} -O bam --write-index -o {}##idx##{} -".format(
+        cmd_reads, str(map_threads), reference, reads_input, str(sort_threads), filename_bam_out, filename_bai_out)
     # print(cmd_minimap2)
-    execute_subprocess(cmd_minimap2, isShell=True)
+    execute_piped_subprocess(
+        cmd_minimap2, tag=os.path.basename(filename_bam_out), output_files=[filename_bam_out, filename_bai_out])
+
 
-    cmd_indexing = "samtools", "index", filename_bam_out
-    # print(cmd_indexing)
-    execute_subprocess(cmd_indexing, isShell=False)
+def minimap2_mapping_parallel(mapping_jobs, reference, threads=30, max_jobs=8):
+    """
+    Map several samples at the same time, splitting the threads between the concurrent minimap2 jobs.
+    mapping_jobs: list of (HQ_filename, filename_bam_out) tuples
+    max_jobs: maximum pipelines running at once, each one holds a minimap2 minibatch and sort buffers in memory
+    """
+
+    # minimap2 scales poorly beyond a few threads per process, so several samples are mapped in parallel instead
+    # Each job gets at least 4 threads to share between pigz, minimap2 and sort, and never more than threads in total
+    max_workers = max(1, min(len(mapping_jobs), threads // 4, max_jobs))
+    threads_per_job = max(1, threads // max_workers)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(minimap2_mapping, HQ_filename, filename_bam_out,
+                                   reference, threads=threads_per_job) for HQ_filename, filename_bam_out in mapping_jobs]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
 
 
 def ngmlr_mapping(HQ_filename, filename_bam_out, reference, threads=30):
@@ -233,24 +266,31 @@ def ngmlr_mapping(HQ_filename, filename_bam_out, reference, threads=30):
     # -x <pacbio, ont>, --presets <pacbio, ont>
     # -i <0-1>, --min-identity <0-1> - Alignments with an identity lower than this threshold will be discarded [0.65]
 
-    cmd_ngmlr = "ngmlr -t {} -r {} -q {} -x ont | samtools view -bS -F 4 - | samtools sort -o {}".format(
-        threads, reference, HQ_filename, filename_bam_out)
-    # print(cmd_ngmlr)
-    execute_subprocess(cmd_ngmlr, isShell=True)
+    # -u: Uncompressed BAM output, avoids a compress/decompress round-trip before sort
+    # -F: Only include reads with none of the FLAGS in INT present
 
-    cmd_indexing = "samtools", "index", filename_bam_out
-    # print(cmd_indexing)
-    execute_subprocess(cmd_indexing, isShell=False)
+    filename_bai_out = filename_bam_out + ".bai"
+
+    # threads is the budget of the whole pipeline, a quarter goes to sort and the rest to ngmlr
+    sort_threads = threads // 4
+    map_threads = max(1, threads - sort_threads)
+
+    cmd_ngmlr = "ngmlr -t {} -r {} -q {} -x ont | samtools view -u -F 4 - | samtools sort -@ {} -O bam --write-index -o {}##idx##{} -".format(
+        str(map_threads), reference, HQ_filename, str(sort_threads), filename_bam_out, filename_bai_out)
+    # print(cmd_ngmlr)
+    execute_piped_subprocess(
+        cmd_ngmlr, tag=os.path.basename(filename_bam_out), output_files=[filename_bam_out, filename_bai_out])
 
 
-def freebayes_variant(reference, filename_bam_out, output_vcf, threads=36, frequency=0.1, ploidy=1, base_qual=7, map_qual=60):
+def freebayes_variant(reference, filename_bam_out, output_vcf, threads=36, frequency=0.1, ploidy=1, base_qual=7, map_qual=60, max_coverage=600):
     """
     https://github.com/freebayes/freebayes
         # Freebayes-parallel
         freebayes-parallel <(fasta_generate_regions.py {fai_reference} {chunks}) {threads} {args} > {output}
+        freebayes-parallel <(samtools depth -aa {bam} | coverage_to_regions.py {fai_reference} {regions}) {threads} {args} > {output}
     """
 
-    # region_file: Genome partitioning according to computational threads.
+    # region_file: Genome partitioning with a similar number of aligned bases per region.
     # --haplotype_length: Allow haplotype calls with contiguous embedded matches of up to this length
     # --use-best-n-alleles: Evaluate only the best N SNP alleles, ranked by sum of supporting quality scores
     # --min-alternate-count: Require at least this count of observations supporting an alternate allele within a single individual in order to evaluate the position
@@ -259,12 +299,14 @@ def freebayes_variant(reference, filename_bam_out, output_vcf, threads=36, frequ
     # --min-coverage:
     # -q: Exclude alleles from analysis if their supporting base quality is less than Q
     # -m: Exclude alignments from analysis if they have a mapping quality less than Q
+    # --limit-coverage: Downsample per-sample coverage to this level if greater than this coverage, bounds the cost of deep pileups
     # --strict-vcf: Generate strict VCF format (FORMAT/GQ will be an int)
 
-    region_file = create_reference_chunks(reference)
+    region_file = create_coverage_regions(filename_bam_out, reference, os.path.join(
+        os.path.dirname(output_vcf), "coverage.regions"))
 
-    cmd_bayes = "freebayes-parallel {} {} -f {} --haplotype-length 0 --use-best-n-alleles 1 --min-alternate-count 0 --min-alternate-fraction {} -p {} --min-coverage 1 -q {} -m {} --strict-vcf {} > {}".format(
-        region_file, str(threads), reference, str(frequency), str(ploidy), str(base_qual), str(map_qual), filename_bam_out, output_vcf)
+    cmd_bayes = "freebayes-parallel {} {} -f {} --haplotype-length 0 --use-best-n-alleles 1 --min-alternate-count 0 --min-alternate-fraction {} -p {} --min-coverage 1 -q {} -m {} --limit-coverage {} --strict-vcf {} > {}".format(
+        region_file, str(threads), reference, str(frequency), str(ploidy), str(base_qual), str(map_qual), str(max_coverage), filename_bam_out, output_vcf)
     # print(cmd_bayes)
     execute_subprocess(cmd_bayes, isShell=True)
 
@@ -338,21 +380,28 @@ if __name__ == "__main__":
 
     formatter = logging.Formatter("%(asctime)s:%(message)s")
 
-    file_handler = logging.FileHandler(log_full_path)
+    # delay: the log file is opened on the first write
+    file_handler = logging.FileHandler(log_full_path, delay=True)
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
 
+    # Records are written to the log file in batches of 64, logging.shutdown() flushes the rest at exit
+    memory_handler = logging.handlers.MemoryHandler(
+        capacity=64, target=file_handler)
+    memory_handler.setLevel(logging.DEBUG)
+
     stream_handler = logging.StreamHandler()
     stream_handler.setLevel(logging.INFO)
     # stream_handler.setFormatter(formatter)
 
     logger.addHandler(stream_handler)
-    logger.addHandler(file_handler)
+    logger.addHandler(memory_handler)
 
-    logger.info(
-        "\n" + BLUE + "############### START VARIANT CALLING ###############" + END_FORMATTING + "\n")
+    logger.info("\n%s############### START VARIANT CALLING ###############%s\n",
+                BLUE, END_FORMATTING)
 
-    logger.info(args)
+    # Logged as a string: the MemoryHandler formats records on flush, after args.sample has been set
+    logger.info(str(args))
 
     # Obtain all fastq files from folder
 
@@ -360,35 +409,27 @@ if __name__ == "__main__":
 
     # Check how many files will be analysed
 
-    sample_list = []
-
-    for sample in fastq:
-        sample = extract_sample_list(sample)
-        # sample = sample.split('_')[1]
-        sample_list.append(sample)
+    sample_list = [extract_sample_list(sample) for sample in fastq]
 
     # logger.info('\n' + CYAN + '{} Samples will be analysed: {}'.format(
     #     len(sample_list), ', '.join(sample_list)) + END_FORMATTING)
 
     # Check if there are samples to filter out
 
-    sample_list_F = []
     if args.sample_list == None:
-        logger.info("\n" + "No samples to filter" + "\n")
-        for sample in fastq:
-            sample = extract_sample_list(sample)
-            sample_list_F.append(sample)
+        logger.info("\nNo samples to filter\n")
+        sample_list_F = sample_list
     else:
         logger.info("Samples will be filtered")
         sample_list_F = file_to_list(args.sample_list)
 
     new_samples = check_reanalysis(args.output, sample_list_F)
 
-    logger.info(CYAN + "\n%d samples will be analysed: %s" %
-                (len(sample_list_F), ",".join(sample_list_F)) + END_FORMATTING + '\n')
+    logger.info("%s\n%d samples will be analysed: %s%s\n",
+                CYAN, len(sample_list_F), ",".join(sample_list_F), END_FORMATTING)
 
-    logger.info(CYAN + "\n%d NEW samples will be analysed: %s" %
-                (len(new_samples), ",".join(new_samples)) + END_FORMATTING + '\n')
+    logger.info("%s\n%d NEW samples will be analysed: %s%s\n",
+                CYAN, len(new_samples), ",".join(new_samples), END_FORMATTING)
 
     # Declare folders created in pipeline and key files
 
@@ -427,17 +468,57 @@ if __name__ == "__main__":
     out_compare_dir = os.path.join(output_dir, "Compare")
     check_create_dir(out_compare_dir)
 
-    samtools_faidx(args.reference)
+    # Reference index and regions are only needed for variant calling, prepare them while the samples are mapped
+    # A single worker keeps samtools_faidx finished before create_reference_chunks reads the .fai
+
+    reference_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    reference_faidx = reference_executor.submit(
+        samtools_faidx, args.reference)
+    reference_chunks = reference_executor.submit(
+        create_reference_chunks, args.reference)
+
+    ##### MAPPING #####
+
+    # Mapping with minimap2 all the samples lacking an indexed Bam at the same time, before the per-sample analysis
+
+    if not args.amplicon:
+
+        prior = datetime.datetime.now()
+
+        mapping_jobs = []
+
+        # List the Bam folder once instead of checking every index on disk
+        existing_bai = set(os.listdir(out_bam_dir))
+
+        for sample in sample_list:
+            if sample + ".sort.bam.bai" in existing_bai:
+                continue
+            if sample in sample_list_F:
+                HQ_filename = os.path.join(input_dir, sample + ".fastq.gz")
+                filename_bam_out = os.path.join(
+                    out_bam_dir, sample + ".sort.bam")
+                mapping_jobs.append((HQ_filename, filename_bam_out))
+
+        if mapping_jobs:
+            logger.info("%sMapping %d samples in parallel%s",
+                        GREEN, len(mapping_jobs), END_FORMATTING)
+            minimap2_mapping_parallel(
+                mapping_jobs, reference=args.reference, threads=args.threads)
+
+        after = datetime.datetime.now()
+        print(("Done with function minimap2_mapping_parallel in: %s" %
+               (after - prior) + "\n"))
 
-    create_reference_chunks(args.reference)
+    reference_faidx.result()
+    reference_chunks.result()
+    reference_executor.shutdown()
 
     ############### START PIPELINE ###############
 
     new_sample_number = 0
 
-    for sample in fastq:
-        # Extract sample name
-        sample = extract_sample_list(sample)
+    # Sample names were already extracted in sample_list, in the same order as fastq
+    for sample in sample_list:
         args.sample = sample
 
         if sample in sample_list_F:
@@ -447,11 +528,11 @@ if __name__ == "__main__":
             if sample in new_samples:
                 new_sample_number = str(int(new_sample_number) + 1)
                 new_sample_total = str(len(new_samples))
-                logger.info("\n" + WHITE_BG + "STARTING SAMPLE: " + sample + " (" + sample_number + "/" +
-                            sample_total + ")" + " (" + new_sample_number + "/" + new_sample_total + ")" + END_FORMATTING)
+                logger.info("\n%sSTARTING SAMPLE: %s (%s/%s) (%s/%s)%s",
+                            WHITE_BG, sample, sample_number, sample_total, new_sample_number, new_sample_total, END_FORMATTING)
             else:
-                logger.info("\n" + WHITE_BG + "STARTING SAMPLE: " + sample +
-                            " (" + sample_number + "/" + sample_total + ")" + END_FORMATTING)
+                logger.info("\n%sSTARTING SAMPLE: %s (%s/%s)%s",
+                            WHITE_BG, sample, sample_number, sample_total, END_FORMATTING)
 
             # if not os.path.isfile(output_final_vcf):
             HQ_filename = os.path.join(
@@ -461,8 +542,8 @@ if __name__ == "__main__":
             filename_out = sample
             # print(filename_out)
 
-            logger.info("\n" + GREEN + BOLD +
-                        "STARTING ANALYSIS FOR SAMPLE " + filename_out + END_FORMATTING + '\n')
+            logger.info("\n%s%sSTARTING ANALYSIS FOR SAMPLE %s%s\n",
+                        GREEN, BOLD, filename_out, END_FORMATTING)
 
             ##### SPECIES DETERMINATION #####
 
@@ -479,26 +560,26 @@ if __name__ == "__main__":
 
             if args.kraken2_db != False:
                 if os.path.isfile(krona_html):
-                    logger.info(
-                        YELLOW + krona_html + " EXIST\nOmmiting species determination with Kraken2 for " + sample + END_FORMATTING)
+                    logger.info("%s%s EXIST\nOmmiting species determination with Kraken2 for %s%s",
+                                YELLOW, krona_html, sample, END_FORMATTING)
                 else:
-                    logger.info(
-                        GREEN + "Species determination with Kraken2 for sample " + sample + END_FORMATTING)
+                    logger.info("%sSpecies determination with Kraken2 for sample %s%s",
+                                GREEN, sample, END_FORMATTING)
                     kraken(HQ_filename, report, args.kraken2_db,
                            krona_html, threads=args.threads)
             else:
-                logger.info(
-                    YELLOW + BOLD + "No Kraken database suplied, skipping specie assignation in group " + group_name + END_FORMATTING)
+                logger.info("%s%sNo Kraken database suplied, skipping specie assignation in group %s%s",
+                            YELLOW, BOLD, group_name, END_FORMATTING)
 
             # Species determination with mash and its bacterial database
 
             if args.mash_db != False:
                 if os.path.isfile(mash_output):
-                    logger.info(
-                        YELLOW + mash_output + " EXIST\nOmmiting species determination with Mash screen for " + sample + END_FORMATTING)
+                    logger.info("%s%s EXIST\nOmmiting species determination with Mash screen for %s%s",
+                                YELLOW, mash_output, sample, END_FORMATTING)
                 else:
-                    logger.info(
-                        GREEN + "Species determination with Mash for sample " + sample + END_FORMATTING)
+                    logger.info("%sSpecies determination with Mash for sample %s%s",
+                                GREEN, sample, END_FORMATTING)
 
                     mash_screen(HQ_filename, mash_output,
                                 args.mash_db, winner=True, threads=args.threads)
@@ -509,8 +590,8 @@ if __name__ == "__main__":
                     output_sort_species.to_csv(
                         mash_output, sep='\t', index=None)
             else:
-                logger.info(
-                    YELLOW + BOLD + "No MASH database suplied, skipping specie assignation in group " + group_name + END_FORMATTING)
+                logger.info("%s%sNo MASH database suplied, skipping specie assignation in group %s%s",
+                            YELLOW, BOLD, group_name, END_FORMATTING)
 
             after = datetime.datetime.now()
             print(("Done with function kraken & mash_screen in: %s" %
@@ -529,18 +610,17 @@ if __name__ == "__main__":
             # print(filename_bam_out)
 
             if os.path.isfile(filename_bai_out):
-                logger.info(YELLOW + filename_bam_out +
-                            " EXIST\nOmmiting mapping for " + filename_out + END_FORMATTING)
+                logger.info("%s%s EXIST\nOmmiting mapping for %s%s",
+                            YELLOW, filename_bam_out, filename_out, END_FORMATTING)
             else:
-                logger.info(GREEN + "Mapping sample " +
-                            filename_out + END_FORMATTING)
+                logger.info("%sMapping sample %s%s", GREEN, filename_out, END_FORMATTING)
 
                 if args.amplicon:
                     ngmlr_mapping(HQ_filename, filename_bam_out,
                                   reference, threads=args.threads)
                 else:
                     minimap2_mapping(HQ_filename, filename_bam_out,
-                                     reference=args.reference)
+                                     reference=args.reference, threads=args.threads)
 
             after = datetime.datetime.now()
             print(f"Done with function {'ngmlr_mapping' if args.amplicon else 'minimap2_mapping'} in: %s" % (
@@ -563,11 +643,11 @@ if __name__ == "__main__":
                 prior = datetime.datetime.now()
 
                 if os.path.isfile(output_raw_vcf):
-                    logger.info(
-                        YELLOW + output_raw_vcf + " EXIST\nOmmiting Variant Calling for sample " + filename_out + END_FORMATTING)
+                    logger.info("%s%s EXIST\nOmmiting Variant Calling for sample %s%s",
+                                YELLOW, output_raw_vcf, filename_out, END_FORMATTING)
                 else:
-                    logger.info(
-                        GREEN + "Starting Variant Calling for sample " + filename_out + END_FORMATTING)
+                    logger.info("%sStarting Variant Calling for sample %s%s",
+                                GREEN, filename_out, END_FORMATTING)
                     if args.amplicon:
                         freebayes(args.reference, filename_bam_out, output_raw_vcf,
                                       frequency=args.min_allele_frequency, ploidy=args.ploidy, base_qual=args.min_quality, map_qual=args.min_mapping)
@@ -593,11 +673,11 @@ if __name__ == "__main__":
                 prior = datetime.datetime.now()
 
                 if os.path.isfile(output_vcf_sub):
-                    logger.info(
-                        YELLOW + output_vcf_sub + " EXIST\nOmmiting Variant Calling filter in " + filename_out + END_FORMATTING)
+                    logger.info("%s%s EXIST\nOmmiting Variant Calling filter in %s%s",
+                                YELLOW, output_vcf_sub, filename_out, END_FORMATTING)
                 else:
-                    logger.info(
-                        GREEN + "Variant Calling filtering in sample " + filename_out + END_FORMATTING)
+                    logger.info("%sVariant Calling filtering in sample %s%s",
+                                GREEN, filename_out, END_FORMATTING)
                     bcftool_filter(output_raw_vcf, output_vcf)
                     snippy_sub(output_vcf, output_vcf_sub)
 
@@ -620,19 +700,17 @@ if __name__ == "__main__":
                 prior = datetime.datetime.now()
 
                 if os.path.isfile(out_variant_indel_sample):
-                    logger.info(YELLOW + out_variant_indel_sample +
-                                " EXIST\nOmmiting INDEL filtering in " + filename_out + END_FORMATTING)
+                    logger.info("%s%s EXIST\nOmmiting INDEL filtering in %s%s",
+                                YELLOW, out_variant_indel_sample, filename_out, END_FORMATTING)
                 else:
-                    logger.info(GREEN + "Filtering INDELs in " +
-                                filename_out + END_FORMATTING)
+                    logger.info("%sFiltering INDELs in %s%s", GREEN, filename_out, END_FORMATTING)
                     extract_indels(output_vcf)
 
                 if os.path.isfile(out_variant_all_sample):
-                    logger.info(YELLOW + out_variant_all_sample +
-                                "EXIST\nOmmiting VCF combination for sample " + filename_out + END_FORMATTING)
+                    logger.info("%s%sEXIST\nOmmiting VCF combination for sample %s%s",
+                                YELLOW, out_variant_all_sample, filename_out, END_FORMATTING)
                 else:
-                    logger.info(GREEN + "Combining VCF in " +
-                                filename_out + END_FORMATTING)
+                    logger.info("%sCombining VCF in %s%s", GREEN, filename_out, END_FORMATTING)
                     merge_vcf(output_vcf_sub, out_variant_indel_sample)
 
                 after = datetime.datetime.now()
@@ -648,11 +726,11 @@ if __name__ == "__main__":
                 prior = datetime.datetime.now()
 
                 if os.path.isfile(out_variant_tsv_file):
-                    logger.info(YELLOW + out_variant_tsv_file +
-                                " EXIST\nOmmiting format adaptation for " + filename_out + END_FORMATTING)
+                    logger.info("%s%s EXIST\nOmmiting format adaptation for %s%s",
+                                YELLOW, out_variant_tsv_file, filename_out, END_FORMATTING)
                 else:
-                    logger.info(
-                        GREEN + "Adapting variants format in sample " + filename_out + END_FORMATTING)
+                    logger.info("%sAdapting variants format in sample %s%s",
+                                GREEN, filename_out, END_FORMATTING)
                     vcf_to_ivar_tsv(out_variant_all_sample,
                                     out_variant_tsv_file)
 
@@ -671,11 +749,11 @@ if __name__ == "__main__":
                 prior = datetime.datetime.now()
 
                 if os.path.isfile(out_consensus_file):
-                    logger.info(YELLOW + out_consensus_file +
-                                " EXIST\nOmmiting Consensus for " + filename_out + END_FORMATTING)
+                    logger.info("%s%s EXIST\nOmmiting Consensus for %s%s",
+                                YELLOW, out_consensus_file, filename_out, END_FORMATTING)
                 else:
-                    logger.info(
-                        GREEN + "Creating Consensus in sample " + filename_out + END_FORMATTING)
+                    logger.info("%sCreating Consensus in sample %s%s",
+                                GREEN, filename_out, END_FORMATTING)
 
                     # Find another solution, if we set q>7 an error occur "Segmentation fault", they are trying to fix it.
                     ivar_consensus(filename_bam_out, out_consensus_dir, filename_out, min_quality=5,
@@ -706,11 +784,10 @@ if __name__ == "__main__":
         prior = datetime.datetime.now()
 
         if os.path.isfile(out_bamstats_file):
-            logger.info(YELLOW + out_bamstats_file +
-                        "EXIST\nOmmiting Bamstats for " + filename_out + END_FORMATTING)
+            logger.info("%s%sEXIST\nOmmiting Bamstats for %s%s",
+                        YELLOW, out_bamstats_file, filename_out, END_FORMATTING)
         else:
-            logger.info(GREEN + "Creating Bamstats in sample " +
-                        filename_out + END_FORMATTING)
+            logger.info("%sCreating Bamstats in sample %s%s", GREEN, filename_out, END_FORMATTING)
             create_bamstat(filename_bam_out, out_bamstats_file,
                            threads=args.threads)
 
@@ -728,11 +805,10 @@ if __name__ == "__main__":
         prior = datetime.datetime.now()
 
         if os.path.isfile(out_coverage_file):
-            logger.info(YELLOW + out_coverage_file +
-                        " EXIST\nOmmiting Coverage for " + filename_out + END_FORMATTING)
+            logger.info("%s%s EXIST\nOmmiting Coverage for %s%s",
+                        YELLOW, out_coverage_file, filename_out, END_FORMATTING)
         else:
-            logger.info(GREEN + "Creating Coverage in sample " +
-                        filename_out + END_FORMATTING)
+            logger.info("%sCreating Coverage in sample %s%s", GREEN, filename_out, END_FORMATTING)
             create_coverage(filename_bam_out, out_coverage_file)
 
         after = datetime.datetime.now()
@@ -743,14 +819,14 @@ if __name__ == "__main__":
 
     prior = datetime.datetime.now()
 
-    logger.info(GREEN + BOLD + "Creating summary report for coverage results in group " +
-                group_name + END_FORMATTING)
+    logger.info("%s%sCreating summary report for coverage results in group %s%s",
+                GREEN, BOLD, group_name, END_FORMATTING)
     obtain_group_cov_stats(out_stats_dir, group_name)
 
     # Reads and Variants output summary
 
-    logger.info(GREEN + BOLD + "Creating overal summary report in group " +
-                group_name + END_FORMATTING)
+    logger.info("%s%sCreating overal summary report in group %s%s",
+                GREEN, BOLD, group_name, END_FORMATTING)
     obtain_overal_stats(out_stats_dir, output_dir, group_name)
 
     after = datetime.datetime.now()
@@ -761,25 +837,24 @@ if __name__ == "__main__":
 
     prior = datetime.datetime.now()
 
-    logger.info(GREEN + "Removing low quality samples in group " +
-                group_name + END_FORMATTING)
+    logger.info("%sRemoving low quality samples in group %s%s", GREEN, group_name, END_FORMATTING)
 
     uncovered_samples = remove_low_quality(
         output_dir, output_dir, cov20=args.coverage20, unmapped_per=args.unmapped, min_hq_snp=args.min_snp, type_remove="Uncovered")
 
     if len(uncovered_samples) > 1:
-        logger.info(RED + BOLD + "Uncovered samples: " +
-                    (",").join(uncovered_samples) + END_FORMATTING)
+        logger.info("%s%sUncovered samples: %s%s",
+                    RED, BOLD, (",").join(uncovered_samples), END_FORMATTING)
     else:
-        logger.info(GREEN + "NO uncovered samples found" + END_FORMATTING)
+        logger.info("%sNO uncovered samples found%s", GREEN, END_FORMATTING)
 
     after = datetime.datetime.now()
     print(("Done with function remove_low_quality in: %s" % (after - prior) + "\n"))
 
     ##### ANNOTATION #####
 
-    logger.info("\n\n" + BLUE + BOLD + "STARTING ANNOTATION IN GROUP: " +
-                group_name + END_FORMATTING + "\n")
+    logger.info("\n\n%s%sSTARTING ANNOTATION IN GROUP: %s%s\n",
+                BLUE, BOLD, group_name, END_FORMATTING)
 
     # Annotation with SnpEFF
 
@@ -801,18 +876,18 @@ if __name__ == "__main__":
                     # print(out_annot_file)
 
                     if os.path.isfile(out_annot_file):
-                        logger.info(YELLOW + DIM + out_annot_file +
-                                    " EXIST\nOmmiting SnpEFF Annotation for sample " + sample + END_FORMATTING)
+                        logger.info("%s%s%s EXIST\nOmmiting SnpEFF Annotation for sample %s%s",
+                                    YELLOW, DIM, out_annot_file, sample, END_FORMATTING)
                     else:
-                        logger.info(
-                            GREEN + "Annotating sample with SnpEFF: " + sample + END_FORMATTING)
+                        logger.info("%sAnnotating sample with SnpEFF: %s%s",
+                                    GREEN, sample, END_FORMATTING)
                         rename_reference_snpeff(filename, chrom_filename)
                         annotate_snpeff(
                             chrom_filename, out_annot_file, database=args.snpeff_database)
 
     else:
-        logger.info(YELLOW + BOLD + "No SnpEFF database suplied, skipping annotation in group " +
-                    group_name + END_FORMATTING)
+        logger.info("%s%sNo SnpEFF database suplied, skipping annotation in group %s%s",
+                    YELLOW, BOLD, group_name, END_FORMATTING)
 
     after = datetime.datetime.now()
     print(("Done with function rename_reference_snpeff & annotate_snpeff in: %s" % (
@@ -823,8 +898,8 @@ if __name__ == "__main__":
     prior = datetime.datetime.now()
 
     if not args.annot_bed and not args.annot_vcf:
-        logger.info(
-            YELLOW + BOLD + "Ommiting User Annotation, no BED or VCF files supplied" + END_FORMATTING)
+        logger.info("%s%sOmmiting User Annotation, no BED or VCF files supplied%s",
+                    YELLOW, BOLD, END_FORMATTING)
     else:
         for root, _, files in os.walk(out_variant_dir):
             for name in files:
@@ -832,8 +907,7 @@ if __name__ == "__main__":
                 if name == "snps.all.ivar.tsv":
                     sample = root.split("/")[-1]
                     # print(sample)
-                    logger.info(
-                        "User bed/vcf annotation in sample {}".format(sample))
+                    logger.info("User bed/vcf annotation in sample %s", sample)
                     filename = os.path.join(root, name)
                     # print(filename)
                     out_annot_file = os.path.join(
@@ -849,16 +923,15 @@ if __name__ == "__main__":
     prior = datetime.datetime.now()
 
     if not args.annot_aa:
-        logger.info(
-            YELLOW + BOLD + "Ommiting User aa annotation, no AA files supplied" + END_FORMATTING)
+        logger.info("%s%sOmmiting User aa annotation, no AA files supplied%s",
+                    YELLOW, BOLD, END_FORMATTING)
     else:
         for root, _, files in os.walk(out_annot_snpeff_dir):
             if root == out_annot_snpeff_dir:
                 for name in files:
                     if name.endswith(".annot"):
                         sample = name.split(".")[0]
-                        logger.info(
-                            "User aa annotation in sample {}".format(sample))
+                        logger.info("User aa annotation in sample %s", sample)
                         filename = os.path.join(root, name)
                         out_annot_aa_file = os.path.join(
                             out_annot_user_aa_dir, sample + ".tsv")
@@ -878,16 +951,15 @@ if __name__ == "__main__":
     prior = datetime.datetime.now()
 
     if not args.annot_fasta:
-        logger.info(
-            YELLOW + BOLD + "Ommiting User FASTA annotation, no FASTA files supplied" + END_FORMATTING)
+        logger.info("%s%sOmmiting User FASTA annotation, no FASTA files supplied%s",
+                    YELLOW, BOLD, END_FORMATTING)
     else:
         for root, _, files in os.walk(out_consensus_dir):
             for name in files:
                 if name.endswith(".fa"):
                     filename = os.path.join(root, name)
                     sample = root.split("/")[-1]
-                    logger.info(
-                        "User FASTA annotation in sample {}".format(sample))
+                    logger.info("User FASTA annotation in sample %s", sample)
 
                     for db in args.annot_fasta:
                         make_blast(filename, db, sample, out_annot_blast_dir, db_type="nucl",
@@ -900,8 +972,8 @@ if __name__ == "__main__":
 
     # SNPs comparison using tsv variant files
 
-    logger.info("\n\n" + GREEN + BOLD + "STARTING COMPARISON IN GROUP: " +
-                group_name + END_FORMATTING + "\n")
+    logger.info("\n\n%s%sSTARTING COMPARISON IN GROUP: %s%s\n",
+                GREEN, BOLD, group_name, END_FORMATTING)
 
     folder_compare = today + "_" + group_name
     path_compare = os.path.join(out_compare_dir, folder_compare)
@@ -976,8 +1048,8 @@ if __name__ == "__main__":
     prior = datetime.datetime.now()
 
     complex_variants = extract_complex_list(out_variant_dir)
-    logger.debug('Complex positions in all samples:\n{}'.format(
-        (','.join([str(x) for x in complex_variants]))))
+    logger.debug("Complex positions in all samples:\n%s",
+                 ','.join([str(x) for x in complex_variants]))
 
     after = datetime.datetime.now()
     print(("Done with function extract_complex_list in: %s" %
@@ -1024,8 +1096,8 @@ if __name__ == "__main__":
     print(("Done with function extract_bed_positions in: %s" %
            (after - prior) + "\n"))
 
-    logger.info('\n' + MAGENTA + BOLD + 'COMPARISON FINISHED IN GROUP: ' +
-                group_name + END_FORMATTING + '\n')
+    logger.info("\n%s%sCOMPARISON FINISHED IN GROUP: %s%s\n",
+                MAGENTA, BOLD, group_name, END_FORMATTING)
 
-    logger.info("\n" + MAGENTA + BOLD +
-                "##### END OF ONT VARIANT CALLING PIPELINE #####" + "\n" + END_FORMATTING)
+    logger.info("\n%s%s##### END OF ONT VARIANT CALLING PIPELINE #####\n%s",
+                MAGENTA, BOLD, END_FORMATTING)